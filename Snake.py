@@ -2,13 +2,12 @@ import math
 import random
 import pygame
 import random
+import time
 import tkinter as tk
 from tkinter import messagebox
 
 
 class cube():
-    rows = 20
-    w = 500
 
     def __init__(self, start, dirnx=1, dirny=0, color=(255, 0, 0)):
         self.pos = start
@@ -21,8 +20,7 @@ class cube():
         self.dirny = dirny
         self.pos = (self.pos[0] + self.dirnx, self.pos[1] + self.dirny)
 
-    def draw(self, surface, eyes=False):
-        dis = self.w // self.rows
+    def draw(self, surface, dis, eyes=False):
         i = self.pos[0]
         j = self.pos[1]
 
@@ -37,14 +35,13 @@ class cube():
 
 
 class snake():
-    body = []
-    turns = {}
 
     def __init__(self, color, pos):
         # pos is given as coordinates on the grid ex (1,5)
         self.color = color
         self.head = cube(pos)
-        self.body.append(self.head)
+        self.body = [self.head]
+        self.turns = {}
         self.dirnx = 0
         self.dirny = 1
 
@@ -105,12 +102,12 @@ class snake():
         self.body[-1].dirnx = dx
         self.body[-1].dirny = dy
 
-    def draw(self, surface):
+    def draw(self, surface, dis):
         for i, c in enumerate(self.body):
             if i == 0:
-                c.draw(surface, True)
+                c.draw(surface, dis, True)
             else:
-                c.draw(surface)
+                c.draw(surface, dis)
 
     def get_pos(self):
         positions = [p.pos for p in self.body]
@@ -124,25 +121,54 @@ class SnakeGame:
         self.rows = rows
         self.players = {}
         self.snacks = [cube(randomSnack(rows)) for _ in range(5)]
+        self.listeners = []
+        # Players whose client has dropped, they neither move nor collide until resumed
+        self.paused = set()
+
+    def add_listener(self, callback):
+        # callback receives (kind, user_id, length, timestamp) for every score event
+        self.listeners.append(callback)
+
+    def emit(self, kind, user_id):
+        event = (kind, user_id, len(self.players[user_id].body), time.time())
+        for callback in self.listeners:
+            callback(event)
 
     def add_player(self, user_id, color):
-        self.players[user_id] = snake(color, (10, 10))
+        self.players[user_id] = snake(color, (self.rows // 2, self.rows // 2))
+        self.emit("join", user_id)
 
     def remove_player(self, user_id):
+        self.emit("leave", user_id)
         self.players.pop(user_id)
+        self.paused.discard(user_id)
+
+    def pause_player(self, user_id):
+        self.paused.add(user_id)
+
+    def resume_player(self, user_id):
+        self.paused.discard(user_id)
 
     def move(self, moves):
+        # Players join and leave from the server's client threads while a tick runs, so
+        # work on a snapshot and skip moves queued by players who have already left
+        player_ids = list(self.players)
         moves_ids = set([m[0] for m in moves])
-        still_ids = set(self.players.keys()) - moves_ids
+        still_ids = set(player_ids) - moves_ids - self.paused
         for move in moves:
+            if move[0] in self.paused or move[0] not in self.players:
+                continue
             self.move_player(move[0], move[1])
             # print("moving player {} to {}".format(move[0], move[1]))
 
         for still_id in still_ids:
-            self.move_player(still_id, None)
+            if still_id in self.players:
+                self.move_player(still_id, None)
             # print("moving player {} in the same direction".format(still_id))
 
-        for p_id in self.players.keys():
+        for p_id in player_ids:
+            if p_id in self.paused or p_id not in self.players:
+                continue
             if self.check_collision(p_id):
                 self.reset_player(p_id)
 
@@ -150,6 +176,7 @@ class SnakeGame:
         self.players[user_id].move(key)
 
     def reset_player(self, user_id):
+        self.emit("death", user_id)
         x_start = random.randrange(1, self.rows - 1)
         y_start = random.randrange(1, self.rows - 1)
         self.players[user_id].reset((x_start, y_start))
@@ -164,6 +191,7 @@ class SnakeGame:
                 self.snacks.remove(snack)
                 self.snacks.append(cube(randomSnack(self.rows)))
                 self.players[user_id].addCube()
+                self.emit("snack", user_id)
 
         if self.players[user_id].head.pos in list(map(lambda z: z.pos, self.players[user_id].body[1:])):
             return True
@@ -175,11 +203,31 @@ class SnakeGame:
         return False
 
     def get_state(self):
-        players_pos = [p.get_pos() for p in self.players.values()]
+        players_pos = ["{}@{}".format(user_id, p.get_pos()) for user_id, p in self.players.items()]
         players_pos_str = "**".join(players_pos)
         snacks_pos = "**".join([str(s.pos) for s in self.snacks])
         return players_pos_str + "|" + snacks_pos
 
+    def get_state_view(self, centre, radius):
+        # Same format as get_state, but only with the cells within radius of centre. A snake
+        # with any cell in view keeps its head as the first cell even when the head is out
+        # of view, since the client draws the first cell of every snake as its head.
+        def distance(pos):
+            return max(abs(pos[0] - centre[0]), abs(pos[1] - centre[1]))
+
+        players_pos = []
+        # Built on the client threads, so take a snapshot in case a player joins or leaves
+        for user_id, p in list(self.players.items()):
+            # Each cell is next to the one before it, so a snake whose head is further away
+            # than radius plus its length cannot be in view
+            if distance(p.head.pos) > radius + len(p.body):
+                continue
+            positions = [str(c.pos) for c in p.body[1:] if distance(c.pos) <= radius]
+            if positions or distance(p.head.pos) <= radius:
+                players_pos.append("{}@{}".format(user_id, "*".join([str(p.head.pos)] + positions)))
+        snacks_pos = "**".join([str(s.pos) for s in self.snacks if distance(s.pos) <= radius])
+        return "**".join(players_pos) + "|" + snacks_pos
+
 
 def randomSnack(rows):
     x = random.randrange(1, rows - 1)
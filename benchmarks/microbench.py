@@ -0,0 +1,335 @@
+"""
+Microbenchmarks for the code that runs every tick: the Snake.py engine, state parsing in
+the client and the framing and crypto helpers in network.py.
+
+Every benchmark runs over a grid of workloads (players, snake length, board size) with a
+fixed random seed. Results are written to a JSON file and compared against a stored
+baseline; anything whose median is slower than the baseline's by more than the threshold
+is flagged and the exit status is 1.
+
+    python benchmarks/microbench.py                    # run and compare with the baseline
+    python benchmarks/microbench.py --save-baseline    # run and store as the new baseline
+    python benchmarks/microbench.py --filter SnakeGame --quick
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESULTS = os.path.join(ROOT, "benchmarks", "latest.json")
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+THRESHOLD = 0.15
+REPEAT = 15
+MIN_TIME = 0.1
+SEED = 0
+
+PLAYERS = [1, 10, 100]
+LENGTHS = [1, 10, 100]
+ROWS = [20, 200, 1000]
+QUICK = {"players": [10], "length": [10], "rows": [200]}
+
+try:
+    import Snake
+except ImportError as e:
+    Snake = None
+    SNAKE_ERROR = str(e)
+
+try:
+    import network
+except ImportError as e:
+    network = None
+    NETWORK_ERROR = str(e)
+
+try:
+    import snake_client
+except ImportError as e:
+    snake_client = None
+    CLIENT_ERROR = str(e)
+
+BENCHMARKS = []
+
+
+def benchmark(name, requires=None, **grid):
+    """
+    Register a benchmark. The decorated function takes one keyword per grid axis and
+    returns the zero-argument callable to time, so everything it builds is left out of
+    the measurement.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup, grid, requires))
+        return setup
+    return register
+
+
+def make_game(players, length, rows):
+    # Snakes move right and grow to the left, so give them room on the left
+    game = Snake.SnakeGame(rows)
+    for p in range(players):
+        user_id = "player{}".format(p)
+        game.add_player(user_id, color=(255, 0, 0))
+        head = (random.randrange(length, rows - 1), random.randrange(1, rows - 1))
+        game.players[user_id].reset(head)
+        for _ in range(length - 1):
+            game.players[user_id].addCube()
+    return game
+
+
+def fits(length, rows):
+    return length < rows - 2
+
+
+@benchmark("snake.move", requires="Snake", length=LENGTHS)
+def bench_snake_move(length):
+    s = make_game(1, length, 1000).players["player0"]
+    keys = itertools.cycle(["down", None, "right", None])
+    return lambda: s.move(next(keys))
+
+
+@benchmark("snake.addCube", requires="Snake", length=LENGTHS)
+def bench_snake_add_cube(length):
+    s = make_game(1, length, 1000).players["player0"]
+
+    def add_cube():
+        # Pop again so the length stays fixed across calls
+        s.addCube()
+        s.body.pop()
+    return add_cube
+
+
+@benchmark("SnakeGame.move", requires="Snake", players=PLAYERS, length=LENGTHS, rows=ROWS)
+def bench_game_move(players, length, rows):
+    if not fits(length, rows):
+        return None
+    game = make_game(players, length, rows)
+    player_ids = list(game.players)
+    moves = itertools.cycle(["up", "left", "down", "right"])
+
+    def move():
+        game.move({(player_id, next(moves)) for player_id in player_ids[::2]})
+    return move
+
+
+@benchmark("SnakeGame.check_collision", requires="Snake", length=LENGTHS, rows=ROWS)
+def bench_check_collision(length, rows):
+    if not fits(length, rows):
+        return None
+    game = make_game(1, length, rows)
+    return lambda: game.check_collision("player0")
+
+
+@benchmark("SnakeGame.get_state", requires="Snake", players=PLAYERS, length=LENGTHS)
+def bench_get_state(players, length):
+    game = make_game(players, length, 1000)
+    return game.get_state
+
+
+@benchmark("SnakeGame.get_state_view", requires="Snake", players=PLAYERS, length=LENGTHS)
+def bench_get_state_view(players, length):
+    game = make_game(players, length, 1000)
+    centre = game.get_player("player0")
+    return lambda: game.get_state_view(centre, 12)
+
+
+@benchmark("randomSnack", requires="Snake", rows=ROWS)
+def bench_random_snack(rows):
+    return lambda: Snake.randomSnack(rows)
+
+
+@benchmark("GameClient.parse_pos", requires="snake_client", players=PLAYERS, length=LENGTHS)
+def bench_parse_pos(players, length):
+    pos = make_game(players, length, 1000).get_state()
+    # parse_pos needs no display, so skip __init__ and its pygame window
+    client = snake_client.GameClient.__new__(snake_client.GameClient)
+    return lambda: client.parse_pos(pos)
+
+
+@benchmark("network.parse_state", requires="network", players=PLAYERS, length=LENGTHS)
+def bench_parse_state(players, length):
+    pos = make_game(players, length, 1000).get_state()
+    return lambda: network.parse_state(pos)
+
+
+@benchmark("network.parse_server_response", requires="network", players=PLAYERS, length=LENGTHS)
+def bench_parse_server_response(players, length):
+    response = "pos:{}".format(make_game(players, length, 1000).get_state())
+    return lambda: network.parse_server_response(response)
+
+
+@benchmark("network.encrypt_message", requires="network")
+def bench_encrypt():
+    public_key = network.shared_private_key().public_key()
+    return lambda: network.encrypt_message(public_key, b"control:get")
+
+
+@benchmark("network.decrypt_message", requires="network")
+def bench_decrypt():
+    private_key = network.shared_private_key()
+    encrypted = network.encrypt_message(private_key.public_key(), b"control:get")
+    return lambda: network.decrypt_message(private_key, encrypted)
+
+
+@benchmark("network.frame", requires="network", players=PLAYERS, length=LENGTHS)
+def bench_frame(players, length):
+    payload = "pos:{}".format(make_game(players, length, 1000).get_state()).encode()
+    return lambda: network.frame(payload)
+
+
+@benchmark("network.unframe", requires="network", players=PLAYERS, length=LENGTHS)
+def bench_unframe(players, length):
+    payload = "pos:{}".format(make_game(players, length, 1000).get_state()).encode()
+    private_key = network.shared_private_key()
+    return lambda: network.unframe(private_key, payload)
+
+
+def missing_requirement(requires):
+    errors = {
+        "Snake": None if Snake else SNAKE_ERROR,
+        "network": None if network else NETWORK_ERROR,
+        "snake_client": None if snake_client else CLIENT_ERROR,
+    }
+    return errors.get(requires)
+
+
+def workloads(grid, quick):
+    axes = sorted(grid)
+    values = [QUICK[axis] if quick else grid[axis] for axis in axes]
+    for combination in itertools.product(*values):
+        yield dict(zip(axes, combination))
+
+
+def label(name, params):
+    if not params:
+        return name
+    return "{}[{}]".format(name, ",".join("{}={}".format(k, v) for k, v in sorted(params.items())))
+
+
+def calibrate(setup, params):
+    """
+    Number of calls that makes one run take about MIN_TIME, or None if the workload
+    does not apply.
+    """
+    random.seed(SEED)
+    fn = setup(**params)
+    if fn is None:
+        return None
+    number, elapsed = timeit.Timer(fn).autorange()
+    return max(1, int(number * MIN_TIME / elapsed))
+
+
+def time_run(setup, params, number):
+    # Time per call in microseconds on a freshly built workload, so that calls which
+    # change the game (moves, deaths) do not drift between runs
+    random.seed(SEED)
+    fn = setup(**params)
+    return timeit.Timer(fn).timeit(number) / number * 1e6
+
+
+def run(pattern=None, quick=False):
+    """
+    Time every workload REPEAT times and keep the median. The runs are interleaved, one
+    round over all workloads per repeat, so a burst of load on the machine spoils one run
+    of many workloads rather than every run of one, and the median throws it away.
+    """
+    pending, skipped = [], {}
+    for name, setup, grid, requires in BENCHMARKS:
+        if pattern and pattern not in name:
+            continue
+        error = missing_requirement(requires)
+        if error:
+            skipped[name] = error
+            print("{:<60} skipped: {}".format(name, error))
+            continue
+        for params in workloads(grid, quick):
+            number = calibrate(setup, params)
+            if number is not None:
+                pending.append((label(name, params), setup, params, number))
+
+    runs = {key: [] for key, _, _, _ in pending}
+    for round_number in range(REPEAT):
+        print("round {} of {}".format(round_number + 1, REPEAT), end="\r", flush=True)
+        for key, setup, params, number in pending:
+            runs[key].append(time_run(setup, params, number))
+    # End the progress line so the results start on a line of their own
+    print()
+
+    results = {}
+    for key, _, _, number in pending:
+        results[key] = {
+            "us_per_call": statistics.median(runs[key]),
+            "best_us": min(runs[key]),
+            "worst_us": max(runs[key]),
+            "number": number,
+            "repeat": REPEAT,
+        }
+        print("{:<60} {:>12.2f} us".format(key, results[key]["us_per_call"]))
+    return results, skipped
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print()
+    print("{:<60} {:>12} {:>12} {:>8}".format("benchmark", "now (us)", "base (us)", "change"))
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        now, base = result["us_per_call"], baseline[key]["us_per_call"]
+        change = now / base - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print("{:<60} {:>12.2f} {:>12.2f} {:>+7.1%}{}".format(key, now, base, change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the engine and protocol")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--quick", action="store_true", help="one workload per benchmark")
+    parser.add_argument("--output", default=RESULTS, help="where to write the results")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="slowdown that counts as a regression, 0.15 is 15%%")
+    args = parser.parse_args()
+
+    results, skipped = run(args.filter, args.quick)
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+        "skipped": skipped,
+    }
+    output = args.baseline if args.save_baseline else args.output
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("\nResults written to {}".format(output))
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print("\n{} regression(s) over {:.0%}".format(len(regressions), args.threshold))
+        return 1
+    print("\nNo regressions over {:.0%}".format(args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
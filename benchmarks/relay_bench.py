@@ -0,0 +1,151 @@
+"""
+Benchmark for the spectator relay. Starts spectator_relay.py as its own process, feeds it
+a synthetic game stream and connects many local viewers to it, then reports delivery
+latency, missed frames and the relay's CPU use.
+
+    python benchmarks/relay_bench.py --viewers 1000
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from framing import frame
+
+CONNECT_BATCH = 100
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def make_state(tick, players, length):
+    # Same format as SnakeGame.get_state; the first snack carries the tick number
+    snakes = "**".join("player{}@{}".format(p, "*".join(str((p % 100, y)) for y in range(length)))
+                       for p in range(players))
+    return "{}|({}, 0)**(3, 4)".format(snakes, tick)
+
+
+def tick_of(message):
+    return int(message.rsplit(b"|", 1)[1][1:].split(b",", 1)[0])
+
+
+class FakeServer:
+    """
+    Stands in for the game server's spectator stream, sending one frame per tick.
+    """
+
+    def __init__(self, rate, players, length):
+        self.interval = 1 / rate
+        self.players = players
+        self.length = length
+        self.sent_at = {}
+        self.bytes_sent = 0
+
+    async def handle(self, reader, writer):
+        await reader.readexactly(len(b"spectate"))
+        writer.write(frame(b"spectate:1000"))
+        tick = 0
+        try:
+            while True:
+                tick += 1
+                message = frame("pos:{}".format(make_state(tick, self.players, self.length)).encode())
+                self.sent_at[tick] = time.perf_counter()
+                self.bytes_sent += len(message)
+                writer.write(message)
+                await writer.drain()
+                await asyncio.sleep(self.interval)
+        except (ConnectionError, asyncio.CancelledError):
+            # The relay went away or the benchmark is shutting down
+            writer.close()
+
+
+async def viewer(port, latencies, stop):
+    reader, writer = await asyncio.open_connection("localhost", port)
+    writer.write(b"spectate")
+    try:
+        while not stop.is_set():
+            length_prefix = await reader.readexactly(4)
+            message = await reader.readexactly(int.from_bytes(length_prefix, byteorder='big'))
+            if message.startswith(b"pos:"):
+                latencies.append((tick_of(message), time.perf_counter()))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float("nan")
+
+
+async def run(args):
+    fake = FakeServer(args.rate, args.players, args.length)
+    server_port, relay_port = free_port(), free_port()
+    server = await asyncio.start_server(fake.handle, "localhost", server_port)
+    relay = subprocess.Popen([sys.executable, os.path.join(ROOT, "spectator_relay.py"),
+                              "--port", str(server_port), "--relay-port", str(relay_port)],
+                             stdout=subprocess.DEVNULL)
+    try:
+        await asyncio.sleep(1.0)
+        latencies, stop = [], asyncio.Event()
+        tasks = []
+        for start in range(0, args.viewers, CONNECT_BATCH):
+            batch = [asyncio.ensure_future(viewer(relay_port, latencies, stop))
+                     for _ in range(start, min(args.viewers, start + CONNECT_BATCH))]
+            tasks.extend(batch)
+            await asyncio.sleep(0.05)
+        # Measure only once every viewer is connected
+        await asyncio.sleep(1.0)
+        first_tick = max(fake.sent_at)
+        latencies.clear()
+        await asyncio.sleep(args.duration)
+        last_tick = max(fake.sent_at)
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        relay.send_signal(signal.SIGINT)
+        relay.wait()
+        server.close()
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    measured = [(arrived - fake.sent_at[tick]) * 1000 for tick, arrived in latencies
+                if first_tick < tick <= last_tick]
+    expected = (last_tick - first_tick) * args.viewers
+    frame_size = len(frame("pos:{}".format(make_state(0, args.players, args.length)).encode()))
+    print("viewers:            {}".format(args.viewers))
+    print("frame size:         {} bytes, {} ticks/s".format(frame_size, args.rate))
+    print("frames delivered:   {} of {} ({:.1%})".format(len(measured), expected,
+                                                           len(measured) / expected if expected else 0))
+    print("latency p50/p99:    {:.1f} / {:.1f} ms".format(percentile(measured, 0.5),
+                                                         percentile(measured, 0.99)))
+    print("relay CPU:          {:.2f}s user+sys over the whole run".format(usage.ru_utime + usage.ru_stime))
+    print("upstream traffic:   {} bytes (independent of viewers)".format(fake.bytes_sent))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the spectator relay")
+    parser.add_argument("--viewers", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to measure")
+    parser.add_argument("--rate", type=float, default=5.0, help="ticks per second")
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--length", type=int, default=10, help="segments per snake")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
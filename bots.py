@@ -0,0 +1,52 @@
+"""
+Runs many headless bots against a server from a single process, for soak tests.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from network import AsyncSnakeClient, SERVER, PORT, shared_private_key
+
+DIRECTIONS = ["up", "down", "left", "right"]
+
+
+async def bot(server, port, duration, interval):
+    client = await AsyncSnakeClient(server, port).connect()
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        if random.random() < 0.2:
+            state = await client.send_input(random.choice(DIRECTIONS))
+        else:
+            state = await client.poll()
+        if state is None:
+            break
+        await asyncio.sleep(interval)
+    await client.close()
+
+
+async def run_bots(count, server, port, duration, interval):
+    # Generate the shared key once up front instead of inside the first bot
+    shared_private_key()
+    start = time.time()
+    results = await asyncio.gather(*[bot(server, port, duration, interval) for _ in range(count)],
+                                   return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    print("{} bots finished in {:.1f}s, {} errors".format(count, time.time() - start, len(errors)))
+    for error in errors[:5]:
+        print("  {!r}".format(error))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run headless snake bots")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--server", default=SERVER)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds each bot plays")
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds between requests")
+    args = parser.parse_args()
+    asyncio.run(run_bots(args.count, args.server, args.port, args.duration, args.interval))
+
+
+if __name__ == "__main__":
+    main()
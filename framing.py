@@ -0,0 +1,24 @@
+"""
+Connection defaults and the length-prefix framing shared by the server, the clients and
+the spectator relay. Nothing here needs cryptography, so the relay can run without it.
+"""
+
+SERVER = "localhost"
+PORT = 5555
+RELAY_PORT = 5556
+
+
+def frame(payload):
+    # Prepend the 4 byte big-endian length prefix used for every message
+    return len(payload).to_bytes(4, byteorder='big') + payload
+
+
+def recv_exactly(sock, length):
+    # None if the connection closes before length bytes arrive
+    data = b''
+    while len(data) < length:
+        packet = sock.recv(length - len(data))
+        if not packet:
+            return None
+        data += packet
+    return data
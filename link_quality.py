@@ -0,0 +1,116 @@
+"""
+Per-connection link quality tracking for the server. Each client gets its own update rate
+and level of detail depending on its round trip time and how much unsent data is queued
+for it in the kernel.
+"""
+
+import socket
+import struct
+
+try:
+    import fcntl
+    import termios
+    TIOCOUTQ = termios.TIOCOUTQ
+except (ImportError, AttributeError):
+    fcntl = None
+    TIOCOUTQ = None
+
+TCP_INFO_RTT_OFFSET = 68  # tcpi_rtt in struct tcp_info, in microseconds
+
+MAX_STRIDE = 4
+RTT_HIGH = 0.25
+RTT_LOW = 0.1
+BACKLOG_HIGH = 64 * 1024
+BACKLOG_LOW = 8 * 1024
+
+MODE_FULL = "full"
+MODE_REDUCED = "reduced"
+
+
+def tcp_rtt(conn):
+    """
+    Smoothed round trip time the kernel has measured for conn, in seconds, or None where
+    TCP_INFO is not available.
+    """
+    if not hasattr(socket, "TCP_INFO"):
+        return None
+    try:
+        info = conn.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+        return struct.unpack_from("I", info, TCP_INFO_RTT_OFFSET)[0] / 1000000
+    except (OSError, struct.error):
+        return None
+
+
+def send_backlog(conn):
+    """
+    Number of bytes written to conn that the peer has not acknowledged yet, or None where
+    the platform cannot tell.
+    """
+    if fcntl is None:
+        return None
+    try:
+        return struct.unpack("I", fcntl.ioctl(conn.fileno(), TIOCOUTQ, struct.pack("I", 0)))[0]
+    except OSError:
+        return None
+
+
+class ClientLink:
+    """
+    Decides, per client, which ticks to send and whether to send the full board or only
+    the area around the client's snake.
+
+    A client that falls behind first gets every second, then every fourth tick, and then
+    the reduced view. It climbs back one step at a time once the link recovers.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rtt = None
+        self.backlog = None
+        self.stride = 1
+        self.mode = MODE_FULL
+        self.last_sent_tick = None
+        self.sent = 0
+        self.skipped = 0
+        self.reduced = 0
+
+    def should_send(self, tick):
+        # Send on the first request, then only when enough new ticks have passed
+        return self.last_sent_tick is None or tick - self.last_sent_tick >= self.stride
+
+    def mark_sent(self, tick):
+        if self.last_sent_tick is not None:
+            # Count the ticks this client never saw, not the polls that were held back
+            self.skipped += tick - self.last_sent_tick - 1
+        self.last_sent_tick = tick
+        self.sent += 1
+        if self.mode == MODE_REDUCED:
+            self.reduced += 1
+        self.update()
+
+    def update(self):
+        self.rtt = tcp_rtt(self.conn)
+        self.backlog = send_backlog(self.conn)
+        rtt = self.rtt or 0
+        backlog = self.backlog or 0
+        if rtt > RTT_HIGH or backlog > BACKLOG_HIGH:
+            if self.stride < MAX_STRIDE:
+                self.stride *= 2
+            else:
+                self.mode = MODE_REDUCED
+        elif rtt < RTT_LOW and backlog < BACKLOG_LOW:
+            if self.mode == MODE_REDUCED:
+                self.mode = MODE_FULL
+            elif self.stride > 1:
+                self.stride //= 2
+
+    def metrics(self):
+        return {
+            "rtt": self.rtt,
+            "backlog": self.backlog,
+            "stride": self.stride,
+            "mode": self.mode,
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "reduced": self.reduced,
+        }
@@ -1,80 +1,219 @@
+"""
+Headless client library for the snake game. It speaks the server protocol without pygame,
+so it can be used by the renderer, bots and load generators alike.
+"""
+
+import asyncio
+import base64
 import socket
+import time
 from cryptography.hazmat.primitives.serialization import load_pem_public_key
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
-import base64
+from framing import SERVER, PORT, RELAY_PORT, frame, recv_exactly
+
+POLL_INTERVAL = 0.05
+MOVES = ["up", "down", "left", "right", "reset"]
+ENCRYPTED_TAG = b'encrypted:'
+
+_shared_private_key = None
+
+
+def shared_private_key():
+    """
+    Return a key pair shared by every client in this process. Generating a 2048 bit key
+    is the slowest part of starting a client, so bots should reuse this one.
+    """
+    global _shared_private_key
+    if _shared_private_key is None:
+        _shared_private_key = generate_private_key()
+    return _shared_private_key
+
+
+def generate_private_key():
+    return rsa.generate_private_key(
+        public_exponent=65537,
+        key_size=2048,
+        backend=default_backend()
+    )
+
+
+def serialize_public_key(public_key):
+    return public_key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode('utf-8')
+
+
+def load_public_key(public_key_str):
+    return load_pem_public_key(public_key_str.encode(), backend=default_backend())
+
+
+def encrypt_message(public_key, message):
+    encrypted_message = public_key.encrypt(
+        message,
+        padding.OAEP(
+            mgf=padding.MGF1(algorithm=hashes.SHA256()),
+            algorithm=hashes.SHA256(),
+            label=None
+        )
+    )
+    return base64.b64encode(encrypted_message)
+
+
+def decrypt_message(private_key, encrypted_message):
+    decrypted_message = private_key.decrypt(
+        base64.b64decode(encrypted_message),
+        padding.OAEP(
+            mgf=padding.MGF1(algorithm=hashes.SHA256()),
+            algorithm=hashes.SHA256(),
+            label=None
+        )
+    )
+    return decrypted_message.decode()
+
+
+def unframe(private_key, full_message):
+    # Messages tagged "encrypted:" are decrypted, the rest are plain text
+    if full_message.startswith(ENCRYPTED_TAG):
+        return decrypt_message(private_key, full_message[len(ENCRYPTED_TAG):])
+    return full_message.decode()
+
+
+def parse_server_response(server_response):
+    """
+    Split a server response into its chat message and position data, either may be None.
+    """
+    if server_response is None:
+        return None, None
+    chat_message, pos_data = None, None
+    if "chat:" in server_response:
+        parts = server_response.split("chat:")
+        chat_message = parts[1].split("pos:")[0] if "pos:" in parts[1] else parts[1]
+    if "pos:" in server_response:
+        parts = server_response.split("pos:")
+        pos_data = parts[1].split("chat:")[0] if "chat:" in parts[1] else parts[1]
+    return chat_message, pos_data.strip() if pos_data else None
+
+
+def parse_welcome(message):
+    """
+    Parse a "welcome:" message into (player_id, rows, resume_token).
+    """
+    _, player_id, rows, resume_token = message.split(":")
+    return player_id, int(rows), resume_token
+
+
+def parse_leaderboard(leaderboard):
+    """
+    Parse a "leaderboard:" message into a list of (player_id, best_length), best first.
+    """
+    entries = []
+    for raw_entry in leaderboard.split("*"):
+        if raw_entry == "":
+            continue
+        player_id, length = raw_entry.rsplit("=", 1)
+        entries.append((player_id, int(length)))
+    return entries
+
+
+def parse_state(pos):
+    """
+    Parse the game state sent by the server into (snacks, players), where players maps
+    each player id to its list of positions, head first.
+    """
+    snacks, players = [], {}
+    if pos is not None:
+        try:
+            raw_players = pos.split("|")[0].split("**")
+            raw_snacks = pos.split("|")[1].split("**")
+            for raw_player in raw_players:
+                if raw_player == "":
+                    continue
+                player_id, raw_player = raw_player.split("@", 1)
+                positions = []
+                for raw_position in raw_player.split("*"):
+                    if raw_position == "":
+                        continue
+                    nums = raw_position.split(')')[0].split('(')[1].split(',')
+                    positions.append((int(nums[0]), int(nums[1])))
+                players[player_id] = positions
+            for raw_snack in raw_snacks:
+                if raw_snack == "":
+                    continue
+                nums = raw_snack.split(')')[0].split('(')[1].split(',')
+                snacks.append((int(nums[0]), int(nums[1])))
+        except:
+            print("Encountered an error for the position:", pos)
+    return snacks, players
 
 
 class Network:
-    def __init__(self):
+    """
+    Network class to handle communication with the server
+    """
+
+    def __init__(self, server=SERVER, port=PORT, private_key=None):
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
-        # self.server = "10.11.250.207"
-        self.server = "localhost"
-        self.port = 5555
+        self.server = server
+        self.port = port
         self.server_public_key = None
+        self.player_id = None
+        self.rows = None
+        self.resume_token = None
+        self.connected = False
         self.addr = (self.server, self.port)
-        self.private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-            backend=default_backend()
-        )
+        self.private_key = private_key if private_key is not None else generate_private_key()
         self.public_key = self.private_key.public_key()
         self.connect()
 
     def connect(self):
         try:
             self.client.connect(self.addr)
-            public_key_str = self.serialize_public_key()
-            self.client.sendall(public_key_str.encode())
+            self.client.sendall(serialize_public_key(self.public_key).encode())
             # Receive and set up public key
-            public_key_str = self.receive()
-            self.server_public_key = load_pem_public_key(
-                public_key_str.encode(),
-                backend=default_backend()
-            )
+            self.server_public_key = load_public_key(self.receive())
+            self.welcome(self.receive())
+            self.connected = True
         except:
             print("Unable to connect to server")
 
-    def encrypt_message(self, message):
-        encrypted_message = self.server_public_key.encrypt(
-            message,
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        )
-        return base64.b64encode(encrypted_message)
-
-    def decrypt_message(self, encrypted_message):
-        decrypted_message = self.private_key.decrypt(
-            base64.b64decode(encrypted_message),
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        )
-        return decrypted_message.decode()
+    def welcome(self, message):
+        self.player_id, self.rows, self.resume_token = parse_welcome(message)
 
-    def serialize_public_key(self):
-        public_key = self.public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        )
-        return public_key.decode('utf-8')
+    def reconnect(self):
+        """
+        Re-attach to the server after the connection dropped. Resuming keeps the snake and
+        reuses the keys from the first handshake; if the session has expired we join again
+        as a new player. Returns the keyframe the server sends on resume, if any.
+        """
+        self.client.close()
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.resume_token is not None and self.server_public_key is not None:
+            try:
+                self.client.connect(self.addr)
+                token = encrypt_message(self.server_public_key, self.resume_token.encode())
+                self.client.sendall(b'resume:' + token)
+                response = self.receive()
+                if response is not None and response.startswith("welcome:"):
+                    self.welcome(response)
+                    self.connected = True
+                    return self.receive()
+            except socket.error as e:
+                print("Unable to resume: {}".format(e))
+                return None
+            self.client.close()
+            self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect()
+        return None
 
     def send(self, data, receive=False):
         try:
             # Encrypt only the message, not the length prefix
-            encrypted_message = self.encrypt_message(data.encode())
-            encrypted_length = len(encrypted_message)
-            length_prefix = encrypted_length.to_bytes(4, byteorder='big')
-            full_message = length_prefix + encrypted_message
-            self.client.sendall(full_message)
+            self.client.sendall(frame(encrypt_message(self.server_public_key, data.encode())))
 
             if receive:
                 return self.receive()
@@ -82,32 +221,348 @@ class Network:
                 return None
         except socket.error as e:
             print(e)
+            self.connected = False
 
     def receive(self):
         # First, receive the length of the message
         try:
-            length_prefix = self.client.recv(4)
+            length_prefix = self._recv_exactly(4)
             if not length_prefix:
                 return None
             message_length = int.from_bytes(length_prefix, byteorder='big')
 
             # Now receive the actual message
-            full_message = b''
-            while len(full_message) < message_length:
-                packet = self.client.recv(message_length - len(full_message))
-                if not packet:
-                    return None
-                full_message += packet
-
-            # Check for "encrypted:" tag
-            if full_message.startswith(b'encrypted:'):
-                # Remove the "encrypted:" tag and decrypt the remaining message
-                encrypted_message = full_message[len(b'encrypted:'):]
-                message = self.decrypt_message(encrypted_message)
-                return message
-            else:
-                # If not encrypted, just decode the message
-                return full_message.decode()
+            full_message = self._recv_exactly(message_length)
+            if full_message is None:
+                return None
+            return unframe(self.private_key, full_message)
         except socket.error as e:
             print("Socket error: {}".format(e))
+            self.connected = False
+            return None
+
+    def _recv_exactly(self, length):
+        data = recv_exactly(self.client, length)
+        if data is None:
+            self.connected = False
+        return data
+
+    def close(self):
+        self.client.close()
+
+
+class BaseClient:
+    """
+    Protocol handling shared by SnakeClient and AsyncSnakeClient: subscribers and the
+    handling of server messages. The subclasses only add the I/O.
+    """
+
+    def __init__(self, server=SERVER, port=PORT, private_key=None):
+        self.server = server
+        self.port = port
+        self.private_key = private_key if private_key is not None else shared_private_key()
+        self.subscribers = []
+        self.chat_subscribers = []
+        self.state = ([], {})
+        self.leaderboard_entries = []
+        self.running = False
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def subscribe_chat(self, callback):
+        self.chat_subscribers.append(callback)
+
+    def check_input(self, key):
+        if key not in MOVES:
+            raise ValueError("Unknown input: {}".format(key))
+        return key
+
+    def _handle_response(self, response):
+        # Returns True once the reply to our request, the position data, has arrived
+        if response.startswith("pos:"):
+            pos = response[len("pos:"):].strip()
+            if pos:
+                self._publish(parse_state(pos))
+            return True
+        if response.startswith("leaderboard:"):
+            self.leaderboard_entries = parse_leaderboard(response[len("leaderboard:"):])
+            return False
+        chat_message, _ = parse_server_response(response)
+        if chat_message is not None:
+            for callback in self.chat_subscribers:
+                callback(chat_message)
+        return False
+
+    def _publish(self, state):
+        self.state = state
+        for callback in self.subscribers:
+            callback(*state)
+
+
+class SnakeClient(BaseClient):
+    """
+    Headless game client. Sends inputs to the server and hands every new state to its
+    subscribers as (snacks, players).
+    """
+
+    def __init__(self, server=SERVER, port=PORT, private_key=None):
+        super().__init__(server, port, private_key)
+        self.network = None
+
+    @property
+    def player_id(self):
+        return self.network.player_id if self.network else None
+
+    @property
+    def rows(self):
+        return self.network.rows if self.network else None
+
+    def connect(self):
+        self.network = Network(self.server, self.port, private_key=self.private_key)
+        if not self.network.connected:
+            self.network.close()
+            self.network = None
+            raise ConnectionError("Unable to connect to {}:{}".format(self.server, self.port))
+        return self
+
+    def send_input(self, key):
+        return self._request(self.check_input(key))
+
+    def chat(self, message):
+        return self._request("chat:{}".format(message))
+
+    def poll(self):
+        return self._request("control:get")
+
+    def leaderboard(self):
+        self._request("control:leaderboard")
+        return self.leaderboard_entries
+
+    def run(self, interval=POLL_INTERVAL):
+        # Poll the server until close() is called or the connection drops
+        self.running = True
+        while self.running:
+            if self.poll() is None and self.running:
+                break
+            time.sleep(interval)
+
+    def close(self):
+        self.running = False
+        if self.network:
+            self.network.send("quit", receive=True)
+            self.network.close()
+            self.network = None
+
+    def _request(self, data):
+        self.network.send(data)
+        # Chat broadcasts can arrive before the reply, keep reading until the state does
+        while True:
+            response = self.network.receive()
+            if response is None:
+                return self._reconnect()
+            if self._handle_response(response):
+                return self.state
+
+    def _reconnect(self):
+        keyframe = self.network.reconnect()
+        if not self.network.connected:
+            return None
+        if keyframe is not None:
+            self._handle_response(keyframe)
+        return self.state
+
+
+class SpectatorClient:
+    """
+    Watches a game without joining it. Connect to a spectator relay (or, for a handful of
+    watchers, straight to the server) and every tick is pushed as (snacks, players).
+    """
+
+    def __init__(self, server=SERVER, port=RELAY_PORT):
+        self.server = server
+        self.port = port
+        self.client = None
+        self.rows = None
+        self.subscribers = []
+        self.state = ([], {})
+        self.running = False
+
+    def connect(self):
+        self.client = socket.create_connection((self.server, self.port))
+        # The server needs this to tell spectators from players, relays ignore it
+        self.client.sendall(b'spectate')
+        # Wait for the board size, which comes before the first state
+        while self.rows is None:
+            if self._receive_message() is None:
+                raise ConnectionError("Stream closed before the game started")
+        return self
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def receive(self):
+        """
+        Block until the next state arrives and return it, or None once the stream ends.
+        """
+        while self.client is not None:
+            message = self._receive_message()
+            if message is None:
+                return None
+            if message.startswith("pos:"):
+                self.state = parse_state(message[len("pos:"):].strip())
+                for callback in self.subscribers:
+                    callback(*self.state)
+                return self.state
+        return None
+
+    def run(self):
+        self.running = True
+        while self.running and self.receive() is not None:
+            pass
+
+    def close(self):
+        self.running = False
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def _receive_message(self):
+        length_prefix = recv_exactly(self.client, 4)
+        if length_prefix is None:
+            return None
+        message = recv_exactly(self.client, int.from_bytes(length_prefix, byteorder='big'))
+        if message is None:
+            return None
+        message = message.decode()
+        if message.startswith("spectate:"):
+            rows = message[len("spectate:"):]
+            if rows == "full":
+                raise ConnectionError("No room for another spectator")
+            self.rows = int(rows)
+        return message
+
+
+class AsyncSnakeClient(BaseClient):
+    """
+    asyncio variant of SnakeClient, so many clients can share one event loop.
+    """
+
+    def __init__(self, server=SERVER, port=PORT, private_key=None):
+        super().__init__(server, port, private_key)
+        self.server_public_key = None
+        self.player_id = None
+        self.rows = None
+        self.resume_token = None
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.server, self.port)
+        self.writer.write(serialize_public_key(self.private_key.public_key()).encode())
+        await self.writer.drain()
+        server_public_key = await self.receive()
+        welcome = await self.receive()
+        if server_public_key is None or welcome is None:
+            self.writer.close()
+            raise ConnectionError("Server closed the connection during the handshake")
+        self.server_public_key = load_public_key(server_public_key)
+        self.welcome(welcome)
+        return self
+
+    def welcome(self, message):
+        self.player_id, self.rows, self.resume_token = parse_welcome(message)
+
+    async def reconnect(self):
+        """
+        Resume the session after the connection dropped, or join again if it has expired.
+        Returns the keyframe the server sends on resume, if any.
+        """
+        self.writer.close()
+        if self.resume_token is not None:
+            self.reader, self.writer = await asyncio.open_connection(self.server, self.port)
+            token = encrypt_message(self.server_public_key, self.resume_token.encode())
+            self.writer.write(b'resume:' + token)
+            await self.writer.drain()
+            response = await self.receive()
+            if response is not None and response.startswith("welcome:"):
+                self.welcome(response)
+                return await self.receive()
+            self.writer.close()
+        await self.connect()
+        return None
+
+    async def send_input(self, key):
+        return await self._request(self.check_input(key))
+
+    async def chat(self, message):
+        return await self._request("chat:{}".format(message))
+
+    async def poll(self):
+        return await self._request("control:get")
+
+    async def leaderboard(self):
+        await self._request("control:leaderboard")
+        return self.leaderboard_entries
+
+    async def run(self, interval=POLL_INTERVAL):
+        self.running = True
+        while self.running:
+            if await self.poll() is None and self.running:
+                break
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        self.running = False
+        if self.writer:
+            try:
+                await self.send("quit")
+                await self.receive()
+            except ConnectionError:
+                pass
+            self.writer.close()
+            self.writer = None
+
+    async def send(self, data):
+        self.writer.write(frame(encrypt_message(self.server_public_key, data.encode())))
+        await self.writer.drain()
+
+    async def receive(self):
+        try:
+            length_prefix = await self.reader.readexactly(4)
+            message_length = int.from_bytes(length_prefix, byteorder='big')
+            full_message = await self.reader.readexactly(message_length)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        return unframe(self.private_key, full_message)
+
+    async def states(self, interval=POLL_INTERVAL):
+        # Async iterator over states, polling the server every interval seconds
+        while True:
+            state = await self.poll()
+            if state is None:
+                return
+            yield state
+            await asyncio.sleep(interval)
+
+    async def _request(self, data):
+        try:
+            await self.send(data)
+        except ConnectionError:
+            return await self._reconnect()
+        while True:
+            response = await self.receive()
+            if response is None:
+                return await self._reconnect()
+            if self._handle_response(response):
+                return self.state
+
+    async def _reconnect(self):
+        try:
+            keyframe = await self.reconnect()
+        except ConnectionError as e:
+            print("Unable to reconnect: {}".format(e))
             return None
+        if keyframe is not None:
+            self._handle_response(keyframe)
+        return self.state
@@ -0,0 +1,137 @@
+"""
+Rendering for the snake client. Draws the board through a camera that follows the local
+snake, using pre-rendered sprites and skipping anything that is off-screen.
+"""
+
+import pygame
+
+CELL_SIZE = 25
+GRID_COLOR = (255, 255, 255)
+BACKGROUND_COLOR = (0, 0, 0)
+SNACK_COLOR = (0, 255, 0)
+EYE_COLOR = (0, 0, 0)
+
+
+class Camera:
+    """
+    Camera that maps board cells to screen pixels. It keeps the followed cell centred and
+    stops at the board edges, so a board larger than the window scrolls.
+    """
+
+    def __init__(self, view_width, view_height, rows, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.rows = rows
+        self.cols_visible = view_width // cell_size
+        self.rows_visible = view_height // cell_size
+        self.left = 0
+        self.top = 0
+        self.follow((rows // 2, rows // 2))
+
+    def follow(self, pos):
+        self.left = self._clamp(pos[0] - self.cols_visible // 2, self.cols_visible)
+        self.top = self._clamp(pos[1] - self.rows_visible // 2, self.rows_visible)
+
+    def _clamp(self, start, visible):
+        if self.rows <= visible:
+            # The whole board fits, centre it in the window
+            return -((visible - self.rows) // 2)
+        return max(0, min(start, self.rows - visible))
+
+    def is_visible(self, pos):
+        return self.left <= pos[0] < self.left + self.cols_visible and \
+            self.top <= pos[1] < self.top + self.rows_visible
+
+    def to_screen(self, pos):
+        return (pos[0] - self.left) * self.cell_size, (pos[1] - self.top) * self.cell_size
+
+    def board_rect(self):
+        x, y = self.to_screen((0, 0))
+        size = self.rows * self.cell_size
+        return pygame.Rect(x, y, size, size)
+
+
+class SpriteCache:
+    """
+    Pre-rendered cell sprites, keyed by color. Each sprite is drawn once and then blitted.
+    """
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.segments = {}
+        self.heads = {}
+        self.snack = self._make_segment(SNACK_COLOR)
+
+    def _make_segment(self, color):
+        dis = self.cell_size
+        sprite = pygame.Surface((dis, dis)).convert()
+        sprite.fill(BACKGROUND_COLOR)
+        sprite.set_colorkey(BACKGROUND_COLOR)
+        pygame.draw.rect(sprite, color, (1, 1, dis - 2, dis - 2))
+        return sprite
+
+    def segment(self, color):
+        sprite = self.segments.get(color)
+        if sprite is None:
+            sprite = self.segments[color] = self._make_segment(color)
+        return sprite
+
+    def head(self, color):
+        sprite = self.heads.get(color)
+        if sprite is None:
+            dis = self.cell_size
+            sprite = self._make_segment(color)
+            centre = dis // 2
+            radius = 3
+            pygame.draw.circle(sprite, EYE_COLOR, (centre - radius, 8), radius)
+            pygame.draw.circle(sprite, EYE_COLOR, (dis - radius * 2, 8), radius)
+            self.heads[color] = sprite
+        return sprite
+
+
+class Renderer:
+    """
+    Draws the game state onto a surface through a camera.
+    """
+
+    def __init__(self, surface, rows, colors, cell_size=CELL_SIZE):
+        self.surface = surface
+        self.colors = colors
+        width, height = surface.get_size()
+        self.camera = Camera(width, height, rows, cell_size)
+        self.sprites = SpriteCache(cell_size)
+        self.background = self._make_background(width, height, cell_size)
+
+    def _make_background(self, width, height, cell_size):
+        # The camera moves in whole cells, so the grid lines never move on screen and can be
+        # drawn once.
+        background = pygame.Surface((width, height)).convert()
+        background.fill(BACKGROUND_COLOR)
+        for x in range(cell_size, width + 1, cell_size):
+            pygame.draw.line(background, GRID_COLOR, (x, 0), (x, height))
+        for y in range(cell_size, height + 1, cell_size):
+            pygame.draw.line(background, GRID_COLOR, (0, y), (width, y))
+        return background
+
+    def draw(self, players, snacks, follow_id=None):
+        if follow_id in players and players[follow_id]:
+            self.camera.follow(players[follow_id][0])
+
+        self.surface.fill(BACKGROUND_COLOR)
+        self.surface.set_clip(self.camera.board_rect())
+        self.surface.blit(self.background, (0, 0))
+        self.surface.set_clip(None)
+
+        camera = self.camera
+        blits = []
+        for i, positions in enumerate(players.values()):
+            color = self.colors[i % len(self.colors)]
+            segment = self.sprites.segment(color)
+            for pos_id, pos in enumerate(positions):
+                if camera.is_visible(pos):
+                    sprite = self.sprites.head(color) if pos_id == 0 else segment
+                    blits.append((sprite, camera.to_screen(pos)))
+        for pos in snacks:
+            if camera.is_visible(pos):
+                blits.append((self.sprites.snack, camera.to_screen(pos)))
+        self.surface.blits(blits, doreturn=False)
+        pygame.display.flip()
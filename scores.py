@@ -0,0 +1,169 @@
+"""
+Persistence of scores and match results. Game events are queued in memory and a
+background thread writes them to SQLite in batches, so the game and client threads never
+wait on storage.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+
+DATABASE = "scores.db"
+MAX_QUEUE = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+LEADERBOARD_SIZE = 100
+RETRY_DELAY = 0.5
+MAX_RETRIES = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    kind TEXT NOT NULL,
+    player_id TEXT NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scores (
+    player_id TEXT PRIMARY KEY,
+    best_length INTEGER NOT NULL DEFAULT 0,
+    snacks INTEGER NOT NULL DEFAULT 0,
+    deaths INTEGER NOT NULL DEFAULT 0,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scores_best_length ON scores (best_length DESC);
+"""
+
+UPSERT_SCORE = """
+INSERT INTO scores (player_id, best_length, snacks, deaths, last_seen) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (player_id) DO UPDATE SET
+    best_length = MAX(best_length, excluded.best_length),
+    snacks = snacks + excluded.snacks,
+    deaths = deaths + excluded.deaths,
+    last_seen = excluded.last_seen
+"""
+
+
+class ScoreWriter:
+    """
+    Background writer for game events. record() is cheap and never blocks: when the queue
+    is full the event is dropped and counted instead.
+
+    The writer also keeps the top LEADERBOARD_SIZE best lengths in memory, so leaderboard
+    queries never touch the database.
+    """
+
+    def __init__(self, path=DATABASE, max_queue=MAX_QUEUE):
+        self.path = path
+        self.events = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0
+        self.top = []
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="score-writer", daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        # Stop the writer once everything queued so far is written
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def record(self, event):
+        """
+        Queue an event, a (kind, player_id, length, timestamp) tuple from SnakeGame.
+        """
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def leaderboard(self, n=10):
+        return self.top[:n]
+
+    def _run(self):
+        db = None
+        delay = RETRY_DELAY
+        while db is None:
+            try:
+                db = self._open()
+            except sqlite3.Error as e:
+                print("Error opening score database {}: {}".format(self.path, e))
+                if not self.running:
+                    return
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_DELAY * 2 ** MAX_RETRIES)
+        while self.running or not self.events.empty():
+            batch = self._next_batch()
+            if batch:
+                self._write_with_retry(db, batch)
+        db.close()
+
+    def _open(self):
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(SCHEMA)
+        self.top = db.execute(
+            "SELECT player_id, best_length FROM scores ORDER BY best_length DESC LIMIT ?",
+            (LEADERBOARD_SIZE,)).fetchall()
+        return db
+
+    def _write_with_retry(self, db, batch):
+        # A locked or full database must not kill the writer, back off and try again, and
+        # only give up on this batch after MAX_RETRIES
+        delay = RETRY_DELAY
+        for attempt in range(1, MAX_RETRIES + 1):
+            try:
+                self._write(db, batch)
+                return
+            except sqlite3.Error as e:
+                print("Error writing {} score events (attempt {} of {}): {}".format(
+                    len(batch), attempt, MAX_RETRIES, e))
+                if attempt < MAX_RETRIES:
+                    time.sleep(delay)
+                    delay *= 2
+        self.dropped += len(batch)
+
+    def _next_batch(self):
+        # Wait up to FLUSH_INTERVAL for the first event, then take whatever else is queued
+        batch = []
+        try:
+            batch.append(self.events.get(timeout=FLUSH_INTERVAL))
+            while len(batch) < BATCH_SIZE:
+                batch.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, db, batch):
+        scores = {}
+        for kind, player_id, length, timestamp in batch:
+            best, snacks, deaths, _ = scores.get(player_id, (0, 0, 0, timestamp))
+            scores[player_id] = (max(best, length),
+                                 snacks + (kind == "snack"),
+                                 deaths + (kind == "death"),
+                                 timestamp)
+        with db:
+            db.executemany("INSERT INTO events (kind, player_id, length, timestamp) VALUES (?, ?, ?, ?)",
+                           batch)
+            db.executemany(UPSERT_SCORE,
+                           [(player_id,) + score for player_id, score in scores.items()])
+        self.written += len(batch)
+        self._update_leaderboard(scores)
+
+    def _update_leaderboard(self, scores):
+        # Best lengths only ever grow, so a player can only enter the top list through an
+        # event we have just seen
+        best = dict(self.top)
+        for player_id, score in scores.items():
+            if score[0] > best.get(player_id, 0):
+                best[player_id] = score[0]
+        self.top = sorted(best.items(), key=lambda item: item[1], reverse=True)[:LEADERBOARD_SIZE]
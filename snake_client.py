@@ -1,20 +1,16 @@
 """
 This is the client side of the game. It connects to the server and sends/receives data.
+The protocol lives in network.py, this module only adds input handling and rendering.
 """
 
-import numpy as np
+import argparse
 import pygame
-import socket
-from cryptography.hazmat.primitives.serialization import load_pem_public_key
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
-import base64
+from network import Network, SpectatorClient, SERVER, RELAY_PORT, parse_server_response, parse_state
+from renderer import Renderer
 
 WIDTH = 500
 HEIGHT = 500
-ROWS = 20
+FPS = 60
 RGB_COLORS = {
     "red": (255, 0, 0),
     "green": (0, 255, 0),
@@ -37,158 +33,6 @@ KEYS = {
 }
 
 
-def draw_grid(w, surface):
-    global ROWS
-    sizeBtwn = w // ROWS
-    x = 0
-    y = 0
-    for l in range(ROWS):
-        x = x + sizeBtwn
-        y = y + sizeBtwn
-        pygame.draw.line(surface, (255, 255, 255), (x, 0), (x, w))
-        pygame.draw.line(surface, (255, 255, 255), (0, y), (w, y))
-
-
-def draw_things(surface, positions, color=None, eye=False):
-    global WIDTH, RGB_COLOR_LIST
-    dis = WIDTH // ROWS
-    if color is None:
-        color = (np.random.randint(0, 255),
-                 np.random.randint(0, 255),
-                 np.random.randint(0, 255))
-    for pos_id, pos in enumerate(positions):
-        i, j = pos
-        pygame.draw.rect(surface, color, (i * dis + 1, j * dis + 1, dis - 2, dis - 2))
-        if eye and pos_id == 0:
-            centre = dis // 2
-            radius = 3
-            circleMiddle = (i * dis + centre - radius, j * dis + 8)
-            circleMiddle2 = (i * dis + dis - radius * 2, j * dis + 8)
-            pygame.draw.circle(surface, (0, 0, 0), circleMiddle, radius)
-            pygame.draw.circle(surface, (0, 0, 0), circleMiddle2, radius)
-
-
-def draw(surface, players, snacks):
-    global RGB_COLOR_LIST
-    surface.fill((0, 0, 0))
-    draw_grid(WIDTH, surface)
-    for i, player in enumerate(players):
-        color = RGB_COLOR_LIST[i % len(RGB_COLOR_LIST)]
-        draw_things(surface, player, color=color, eye=True)
-    draw_things(surface, snacks, (0, 255, 0))
-    pygame.display.flip()
-
-
-class Network:
-    """
-    Network class to handle communication with the server
-    """
-
-    def __init__(self):
-        self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-        # self.server = "10.11.250.207"
-        self.server = "localhost"
-        self.port = 5555
-        self.server_public_key = None
-        self.addr = (self.server, self.port)
-        self.private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-            backend=default_backend()
-        )
-        self.public_key = self.private_key.public_key()
-        self.connect()
-
-    def connect(self):
-        try:
-            self.client.connect(self.addr)
-            public_key_str = self.serialize_public_key()
-            self.client.sendall(public_key_str.encode())
-            # Receive and set up public key
-            public_key_str = self.receive()
-            self.server_public_key = load_pem_public_key(
-                public_key_str.encode(),
-                backend=default_backend()
-            )
-        except:
-            print("Unable to connect to server")
-
-    def encrypt_message(self, message):
-        encrypted_message = self.server_public_key.encrypt(
-            message,
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        )
-        return base64.b64encode(encrypted_message)
-
-    def decrypt_message(self, encrypted_message):
-        decrypted_message = self.private_key.decrypt(
-            base64.b64decode(encrypted_message),
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        )
-        return decrypted_message.decode()
-
-    def serialize_public_key(self):
-        public_key = self.public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        )
-        return public_key.decode('utf-8')
-
-    def send(self, data, receive=False):
-        try:
-            # Encrypt only the message, not the length prefix
-            encrypted_message = self.encrypt_message(data.encode())
-            encrypted_length = len(encrypted_message)
-            length_prefix = encrypted_length.to_bytes(4, byteorder='big')
-            full_message = length_prefix + encrypted_message
-            self.client.sendall(full_message)
-
-            if receive:
-                return self.receive()
-            else:
-                return None
-        except socket.error as e:
-            print(e)
-
-    def receive(self):
-        # First, receive the length of the message
-        try:
-            length_prefix = self.client.recv(4)
-            if not length_prefix:
-                return None
-            message_length = int.from_bytes(length_prefix, byteorder='big')
-
-            # Now receive the actual message
-            full_message = b''
-            while len(full_message) < message_length:
-                packet = self.client.recv(message_length - len(full_message))
-                if not packet:
-                    return None
-                full_message += packet
-
-            # Check for "encrypted:" tag
-            if full_message.startswith(b'encrypted:'):
-                # Remove the "encrypted:" tag and decrypt the remaining message
-                encrypted_message = full_message[len(b'encrypted:'):]
-                message = self.decrypt_message(encrypted_message)
-                return message
-            else:
-                # If not encrypted, just decode the message
-                return full_message.decode()
-        except socket.error as e:
-            print("Socket error: {}".format(e))
-            return None
-
-
 class GameClient:
     """
     Game client class to handle the game
@@ -197,7 +41,13 @@ class GameClient:
     def __init__(self):
         pygame.init()
         self.win = pygame.display.set_mode((WIDTH, HEIGHT), pygame.DOUBLEBUF)
+        self.clock = pygame.time.Clock()
         self.network = Network()
+        if not self.network.connected:
+            # Network has already printed why, there is no board to draw
+            pygame.quit()
+            return
+        self.renderer = Renderer(self.win, self.network.rows, RGB_COLOR_LIST)
         self.shouldRun = True
         self.run()
 
@@ -205,24 +55,21 @@ class GameClient:
         while self.shouldRun:
             events = pygame.event.get()
             server_response = self.handle_events(events)
+            if self.shouldRun and not self.network.connected:
+                # Pick the session back up, the server keeps our snake for a while
+                server_response = self.network.reconnect()
             pos = self.handle_server_response(server_response)
             if pos:
                 snacks, players = self.parse_pos(pos)
-                draw(self.win, players, snacks)
+                self.renderer.draw(players, snacks, follow_id=self.network.player_id)
+            self.clock.tick(FPS)
         pygame.quit()
 
     def handle_server_response(self, server_response):
-        if server_response is None:
-            return None
-        pos_data = None
-        if "chat:" in server_response:
-            parts = server_response.split("chat:")
-            chat_message = parts[1].split("pos:")[0] if "pos:" in parts[1] else parts[1]
+        chat_message, pos_data = parse_server_response(server_response)
+        if chat_message is not None:
             print(chat_message)
-        if "pos:" in server_response:
-            parts = server_response.split("pos:")
-            pos_data = parts[1].split("chat:")[0] if "chat:" in parts[1] else parts[1]
-        return pos_data.strip() if pos_data else None
+        return pos_data
 
     def handle_events(self, events):
         for event in events:
@@ -241,36 +88,49 @@ class GameClient:
         return None
 
     def parse_pos(self, pos):
-        snacks, players = [], []
-        if pos is not None:
-            try:
-                raw_players = pos.split("|")[0].split("**")
-                raw_snacks = pos.split("|")[1].split("**")
-                if raw_players == '':
-                    pass
-                else:
-                    for raw_player in raw_players:
-                        raw_positions = raw_player.split("*")
-                        if len(raw_positions) == 0:
-                            continue
+        return parse_state(pos)
+
+
+class SpectatorGameClient:
+    """
+    Renders a game from a spectator relay without joining it
+    """
 
-                        positions = []
-                        for raw_position in raw_positions:
-                            if raw_position == "":
-                                continue
-                            nums = raw_position.split(')')[0].split('(')[1].split(',')
-                            positions.append((int(nums[0]), int(nums[1])))
-                        players.append(positions)
-                for i in range(len(raw_snacks)):
-                    nums = raw_snacks[i].split(')')[0].split('(')[1].split(',')
-                    snacks.append((int(nums[0]), int(nums[1])))
-            except:
-                print("Encountered an error for the position:", pos)
-        return snacks, players
+    def __init__(self, server=SERVER, port=RELAY_PORT):
+        pygame.init()
+        self.win = pygame.display.set_mode((WIDTH, HEIGHT), pygame.DOUBLEBUF)
+        self.spectator = SpectatorClient(server, port).connect()
+        self.renderer = Renderer(self.win, self.spectator.rows, RGB_COLOR_LIST)
+        self.shouldRun = True
+        self.run()
+
+    def run(self):
+        # Frames are pushed once per tick, so receive() paces the loop
+        while self.shouldRun:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.shouldRun = False
+            state = self.spectator.receive()
+            if state is None:
+                break
+            snacks, players = state
+            # Follow the longest snake
+            follow_id = max(players, key=lambda player_id: len(players[player_id]), default=None)
+            self.renderer.draw(players, snacks, follow_id=follow_id)
+        self.spectator.close()
+        pygame.quit()
 
 
 def main():
-    GameClient()
+    parser = argparse.ArgumentParser(description="Multiplayer snake game client")
+    parser.add_argument("--spectate", action="store_true", help="watch through a spectator relay")
+    parser.add_argument("--server", default=SERVER)
+    parser.add_argument("--relay-port", type=int, default=RELAY_PORT)
+    args = parser.parse_args()
+    if args.spectate:
+        SpectatorGameClient(args.server, args.relay_port)
+    else:
+        GameClient()
 
 
 if __name__ == "__main__":
@@ -2,10 +2,15 @@
 This is the server for the multiplayer snake game.
 """
 
+import argparse
 import numpy as np
+import secrets
 import socket
+import threading
 from _thread import *
 from Snake import SnakeGame
+from link_quality import ClientLink, MODE_REDUCED
+from scores import ScoreWriter, DATABASE
 import uuid
 import time
 from cryptography.hazmat.primitives.serialization import load_pem_public_key
@@ -21,6 +26,15 @@ PORT = 5555
 ROWS = 20
 BUFFER_SIZE = 2048
 INTERVAL = 0.2
+RESUME_GRACE = 30.0
+VIEW_RADIUS = 12
+# Cells from its head that a client's window can show: the window is 20 cells across and
+# stops scrolling at the board edges, so the head can sit in a corner of it
+PLAYER_VIEW_RADIUS = 20
+METRICS_INTERVAL = 10.0
+MAX_SPECTATORS = 4
+# Room for many clients connecting at once, such as a bots.py run
+LISTEN_BACKLOG = 128
 
 RGB_COLORS = {
     "red": (255, 0, 0),
@@ -32,22 +46,56 @@ RGB_COLORS = {
 RGB_COLORS_LIST = list(RGB_COLORS.values())
 
 
+class StateStream:
+    """
+    Latest game state for spectators. The game thread only swaps in the new state and
+    wakes the spectator threads, so its cost does not depend on who is watching.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.tick = 0
+        self.state = ""
+        self.subscribers = 0
+
+    def publish(self, tick, state):
+        with self.condition:
+            self.tick = tick
+            self.state = state
+            self.condition.notify_all()
+
+    def wait(self, last_tick):
+        # A slow spectator skips straight to the newest tick
+        with self.condition:
+            self.condition.wait_for(lambda: self.tick != last_tick)
+            return self.tick, self.state
+
+
 class GameServer:
     """
     This is the game server object for the multiplayer snake game.
     """
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, rows=ROWS, database=DATABASE):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             self.server_socket.bind((host, port))
         except socket.error as e:
             print(str(e))
-        self.server_socket.listen(2)
-        self.game = SnakeGame(ROWS)
+        self.server_socket.listen(LISTEN_BACKLOG)
+        self.game = SnakeGame(rows)
+        self.scores = ScoreWriter(database).start()
+        self.game.add_listener(self.scores.record)
         self.game_state = ""
+        self.tick = 0
         self.moves_queue = set()
         self.player_connections = {}
+        self.links = {}
+        self.stream = StateStream()
+        # Resume tokens, kept until the player quits or the grace period runs out
+        self.sessions = {}
+        self.player_keys = {}
+        self.disconnected = {}
         # RSA Key Generation
         self.private_key = rsa.generate_private_key(
             public_exponent=65537,
@@ -62,10 +110,7 @@ class GameServer:
         while True:
             conn, addr = self.server_socket.accept()
             print("Connected to:", addr)
-            unique_id = str(uuid.uuid4())
-            color = RGB_COLORS_LIST[np.random.randint(0, len(RGB_COLORS_LIST))]
-            self.game.add_player(unique_id, color=color)
-            start_new_thread(self.client_thread, (conn, unique_id))
+            start_new_thread(self.client_thread, (conn,))
 
     def send(self, conn, message):
         # Encode the message and prepend length
@@ -144,33 +189,140 @@ class GameServer:
 
     def broadcast_message(self, sender_id, message):
         for player_id in self.game.players:
-            if player_id != sender_id:
+            if player_id != sender_id and player_id in self.player_connections:
                 try:
                     player_conn, player_key = self.player_connections[player_id]
                     self.send_encrypted(player_conn, player_key, "chat:{}: {}".format(sender_id, message))
                 except Exception as e:
                     print("Error broadcasting message to player {}: {}".format(player_id, e))
 
-    def client_thread(self, conn, unique_id):
-        client_public_key_str = conn.recv(1024).decode()
+    def join(self, conn, client_public_key_str):
         client_public_key = load_pem_public_key(
             client_public_key_str.encode(),
             backend=default_backend()
         )
-        # Store the connection and public key
-        self.player_connections[unique_id] = (conn, client_public_key)
+        unique_id = str(uuid.uuid4())
+        color = RGB_COLORS_LIST[np.random.randint(0, len(RGB_COLORS_LIST))]
+        self.game.add_player(unique_id, color=color)
+        token = self.issue_token(unique_id)
+        self.player_keys[unique_id] = client_public_key
         public_key_str = self.serialize_public_key()
         self.send(conn, public_key_str)  # Send public key to client
+        # Tell the client who it is, how big the board is and how to resume
+        self.send_encrypted(conn, client_public_key,
+                            "welcome:{}:{}:{}".format(unique_id, self.game.rows, token))
+        # Store the connection once the handshake is done, so chat broadcasts cannot
+        # arrive in the middle of it
+        self.player_connections[unique_id] = (conn, client_public_key)
+        return unique_id
+
+    def issue_token(self, unique_id):
+        token = secrets.token_urlsafe(16)
+        self.sessions[token] = unique_id
+        return token
+
+    def resume(self, conn, encrypted_token):
+        # The client reuses the keys from its first handshake, so resuming is one round trip.
+        # Tokens are single use: popping it means a captured resume message cannot be
+        # replayed, and only the holder of the client key can read the next token.
+        token = self.decrypt_message(encrypted_token)
+        unique_id = self.sessions.pop(token, None)
+        if unique_id is None or unique_id not in self.game.players:
+            self.send(conn, "resume:expired")
+            return None
+        token = self.issue_token(unique_id)
+        client_public_key = self.player_keys[unique_id]
+        self.send_encrypted(conn, client_public_key,
+                            "welcome:{}:{}:{}".format(unique_id, self.game.rows, token))
+        # Send a keyframe right away so the client can draw without polling first
+        self.send(conn, "pos:{}".format(self.game_state))
+        # Take over from the old connection before closing it, so its thread does not
+        # mark the player as disconnected
+        old_connection = self.player_connections.get(unique_id)
+        self.player_connections[unique_id] = (conn, client_public_key)
+        self.disconnected.pop(unique_id, None)
+        self.game.resume_player(unique_id)
+        if old_connection is not None:
+            old_connection[0].close()
+        print("Player {} resumed".format(unique_id))
+        return unique_id
+
+    def end_session(self, unique_id):
+        for token, session_id in list(self.sessions.items()):
+            if session_id == unique_id:
+                del self.sessions[token]
+        self.player_keys.pop(unique_id, None)
+        self.disconnected.pop(unique_id, None)
+        if unique_id in self.game.players:
+            self.game.remove_player(unique_id)
+
+    def send_leaderboard(self, conn):
+        # Served from the writer's in-memory cache, never from the database
+        entries = ["{}={}".format(player_id, length) for player_id, length in self.scores.leaderboard()]
+        self.send(conn, "leaderboard:{}".format("*".join(entries)))
+
+    def spectator_thread(self, conn):
+        """
+        Push every tick to a spectator without adding it to the game. Spectators are meant
+        to be relays (see spectator_relay.py) that fan the stream out to viewers, so only
+        a few are allowed.
+        """
+        with self.stream.condition:
+            if self.stream.subscribers >= MAX_SPECTATORS:
+                full = True
+            else:
+                full = False
+                self.stream.subscribers += 1
+        if full:
+            self.send(conn, "spectate:full")
+            conn.close()
+            return
+        print("Spectator connected")
+        try:
+            self.send(conn, "spectate:{}".format(self.game.rows))
+            last_tick = None
+            while True:
+                last_tick, state = self.stream.wait(last_tick)
+                self.send(conn, "pos:{}".format(state))
+        except socket.error as e:
+            print("Spectator disconnected: {}".format(e))
+        finally:
+            with self.stream.condition:
+                self.stream.subscribers -= 1
+            conn.close()
+
+    def client_thread(self, conn):
+        try:
+            hello = conn.recv(1024).decode()
+            if hello == "spectate":
+                self.spectator_thread(conn)
+                return
+            if hello.startswith("resume:"):
+                unique_id = self.resume(conn, hello[len("resume:"):])
+            else:
+                unique_id = self.join(conn, hello)
+        except Exception as e:
+            print("Handshake failed: {}".format(e))
+            unique_id = None
+        if unique_id is None:
+            conn.close()
+            return
+        link = ClientLink(conn)
+        self.links[unique_id] = link
+        quit_game = False
         while True:
             try:
                 data = self.receive(conn)
-                self.send(conn, "pos:{}".format(self.game_state))
+                if data == "control:leaderboard":
+                    # Ahead of the reply, clients stop reading once they see "pos:"
+                    self.send_leaderboard(conn)
+                self.send(conn, "pos:{}".format(self.state_for(unique_id, link)))
                 if not data:
                     print("no data received from client")
                     break
                 elif data == "quit":
                     print("received quit")
-                    self.game.remove_player(unique_id)
+                    quit_game = True
                     break
                 elif data == "reset":
                     self.game.reset_player(unique_id)
@@ -180,29 +332,102 @@ class GameServer:
                 elif data.startswith("chat:"):
                     message = data.split(":", 1)[1]
                     self.broadcast_message(unique_id, message)
-                elif data != "control:get":
+                elif data not in ["control:get", "control:leaderboard"]:
                     print("Invalid data received from client:", data)
             except:
                 print("Player {} disconnected".format(unique_id))
                 break
         print("Connection with Player {} closed".format(unique_id))
-        self.game.remove_player(unique_id)
-        del self.player_connections[unique_id]
         conn.close()
+        if self.player_connections.get(unique_id, (None,))[0] is not conn:
+            # The player already resumed on a new connection
+            return
+        del self.player_connections[unique_id]
+        self.links.pop(unique_id, None)
+        if quit_game:
+            self.end_session(unique_id)
+        else:
+            # Keep the snake around, holding still, so the client can resume after a
+            # network blip
+            self.game.pause_player(unique_id)
+            self.disconnected[unique_id] = time.time()
+
+    def state_for(self, unique_id, link):
+        """
+        The state to send to one client. Empty when the client has already seen recent
+        enough state, so it keeps its last frame.
+        """
+        tick = self.tick
+        if not link.should_send(tick):
+            return ""
+        state = self.game_state
+        if unique_id in self.game.players:
+            if link.mode == MODE_REDUCED:
+                state = self.game.get_state_view(self.game.get_player(unique_id), VIEW_RADIUS)
+            elif self.game.rows > 2 * PLAYER_VIEW_RADIUS + 1:
+                # Clients only draw what is around their own snake, so on a large board the
+                # rest would be parsed and thrown away every tick
+                state = self.game.get_state_view(self.game.get_player(unique_id), PLAYER_VIEW_RADIUS)
+        link.mark_sent(tick)
+        return state
+
+    def metrics(self):
+        return {
+            "tick": self.tick,
+            "clients": {unique_id: link.metrics() for unique_id, link in list(self.links.items())},
+        }
+
+    def log_metrics(self):
+        clients = self.metrics()["clients"].values()
+        rates = {}
+        for client in clients:
+            key = "every {} tick(s), {}".format(client["stride"], client["mode"])
+            rates[key] = rates.get(key, 0) + 1
+        print("Tick {}: {} clients, {}".format(
+            self.tick, len(clients), ", ".join("{}: {}".format(k, v) for k, v in sorted(rates.items()))))
+
+    def expire_sessions(self):
+        now = time.time()
+        for unique_id, disconnected_at in list(self.disconnected.items()):
+            if now - disconnected_at > RESUME_GRACE:
+                print("Player {} did not resume, removing".format(unique_id))
+                self.end_session(unique_id)
+
+    def step(self):
+        """
+        Advance the game by one tick.
+        """
+        # Swap the queue out first, client threads keep adding to it during the move
+        moves, self.moves_queue = self.moves_queue, set()
+        self.game.move(moves)
+        self.game_state = self.game.get_state()
+        self.tick += 1
+        self.stream.publish(self.tick, self.game_state)
+        self.expire_sessions()
 
     def game_thread(self):
+        last_metrics_timestamp = time.time()
         while True:
             last_move_timestamp = time.time()
-            self.game.move(self.moves_queue)
-            self.moves_queue = set()
-            self.game_state = self.game.get_state()
+            self.step()
+            if last_move_timestamp - last_metrics_timestamp >= METRICS_INTERVAL:
+                self.log_metrics()
+                last_metrics_timestamp = last_move_timestamp
             while time.time() - last_move_timestamp < INTERVAL:
                 time.sleep(0.1)
 
 
 def main():
-    server = GameServer(SERVER, PORT)
-    server.run()
+    parser = argparse.ArgumentParser(description="Multiplayer snake game server")
+    parser.add_argument("--rows", type=int, default=ROWS, help="size of the square board in cells")
+    parser.add_argument("--database", default=DATABASE, help="SQLite file for scores")
+    args = parser.parse_args()
+    server = GameServer(SERVER, PORT, rows=args.rows, database=args.database)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        print("Shutting down, writing remaining scores")
+        server.scores.close()
 
 
 if __name__ == "__main__":
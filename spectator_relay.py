@@ -0,0 +1,136 @@
+"""
+Spectator relay for the multiplayer snake game. It subscribes once to the server's state
+stream and fans every tick out to any number of viewers, so watching a game costs the
+game server nothing.
+
+Viewers connect to the relay and receive length-prefixed plain text messages: first
+"spectate:<rows>", then a "pos:<state>" message for every tick.
+"""
+
+import argparse
+import asyncio
+import signal
+from framing import SERVER, PORT, RELAY_PORT, frame
+
+RELAY_HOST = "localhost"
+MAX_VIEWER_BUFFER = 256 * 1024
+RETRY_INTERVAL = 2.0
+VIEWER_BACKLOG = 1024
+
+
+class Relay:
+    """
+    Relays the server's state stream to viewers. Every frame is encoded once and the same
+    bytes are written to every viewer. A viewer whose unsent data grows past
+    MAX_VIEWER_BUFFER misses frames until it catches up, instead of slowing the others.
+    """
+
+    def __init__(self, server=SERVER, port=PORT, host=RELAY_HOST, relay_port=RELAY_PORT):
+        self.server = server
+        self.port = port
+        self.host = host
+        self.relay_port = relay_port
+        # Viewer writer -> the task serving it, so shutdown can end every viewer
+        self.viewers = {}
+        self.hello = None
+        self.keyframe = None
+        self.frames = 0
+        self.dropped = 0
+
+    async def run(self):
+        """
+        Relay until SIGINT or SIGTERM, then disconnect every viewer and return.
+        """
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                # No signal handlers on Windows, main() catches KeyboardInterrupt instead
+                pass
+        relay_server = await asyncio.start_server(self.handle_viewer, self.host, self.relay_port,
+                                                  backlog=VIEWER_BACKLOG)
+        print("Relay listening on {}:{}".format(self.host, self.relay_port))
+        follower = asyncio.ensure_future(self.follow())
+        async with relay_server:
+            await stop.wait()
+            relay_server.close()
+            tasks = [follower] + list(self.viewers.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        print("Relay stopped after {} frames, {} dropped".format(self.frames, self.dropped))
+
+    async def follow(self):
+        # Keep following the server stream, reconnecting whenever it is lost
+        while True:
+            try:
+                await self.follow_server()
+            except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+                print("Lost the server stream: {}".format(e))
+            await asyncio.sleep(RETRY_INTERVAL)
+
+    async def follow_server(self):
+        reader, writer = await asyncio.open_connection(self.server, self.port)
+        writer.write(b"spectate")
+        await writer.drain()
+        try:
+            while True:
+                length_prefix = await reader.readexactly(4)
+                message = await reader.readexactly(int.from_bytes(length_prefix, byteorder='big'))
+                if message.startswith(b"spectate:"):
+                    if message == b"spectate:full":
+                        raise ConnectionError("server has no room for another spectator")
+                    # Also tell viewers that are already watching, the board may have changed
+                    self.hello = frame(message)
+                    self.send_all(self.hello)
+                else:
+                    self.keyframe = frame(message)
+                    self.frames += 1
+                    self.send_all(self.keyframe)
+        finally:
+            writer.close()
+
+    def send_all(self, framed):
+        for viewer in self.viewers:
+            if viewer.transport.get_write_buffer_size() > MAX_VIEWER_BUFFER:
+                self.dropped += 1
+                continue
+            viewer.write(framed)
+
+    async def handle_viewer(self, reader, writer):
+        if self.hello is not None:
+            writer.write(self.hello)
+        if self.keyframe is not None:
+            writer.write(self.keyframe)
+        self.viewers[writer] = asyncio.current_task()
+        try:
+            # Viewers never send anything, wait for them to hang up
+            while await reader.read(1024):
+                pass
+        except (ConnectionError, asyncio.CancelledError):
+            # The viewer hung up or the relay is shutting down. Returning instead of
+            # re-raising keeps asyncio from logging every cancelled viewer.
+            pass
+        finally:
+            self.viewers.pop(writer, None)
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay the snake game stream to spectators")
+    parser.add_argument("--server", default=SERVER)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--host", default=RELAY_HOST, help="address viewers connect to")
+    parser.add_argument("--relay-port", type=int, default=RELAY_PORT)
+    args = parser.parse_args()
+    relay = Relay(args.server, args.port, args.host, args.relay_port)
+    try:
+        asyncio.run(relay.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
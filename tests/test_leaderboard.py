@@ -0,0 +1,83 @@
+import socket
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("pygame")
+pytest.importorskip("cryptography")
+
+import network
+import snake_server
+from Snake import SnakeGame
+
+
+class FakeScores:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def leaderboard(self, n=10):
+        return self.entries[:n]
+
+
+class FakeNetwork:
+    """
+    Stands in for network.Network, replaying messages in the order the server sent them.
+    """
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.sent = []
+        self.connected = True
+
+    def send(self, data, receive=False):
+        self.sent.append(data)
+
+    def receive(self):
+        return self.messages.pop(0) if self.messages else None
+
+
+def server_messages(requests, entries):
+    """
+    Run GameServer.client_thread over the given requests and return what it sent.
+    """
+    server = snake_server.GameServer.__new__(snake_server.GameServer)
+    server.game = SnakeGame(20)
+    server.game.add_player("p1", color=(255, 0, 0))
+    server.scores = FakeScores(entries)
+    server.game_state = server.game.get_state()
+    server.tick = 1
+    server.links = {}
+    server.player_connections = {}
+    server.disconnected = {}
+    server.moves_queue = set()
+    server.join = lambda conn, hello: "p1"
+    sent = []
+    server.send = lambda conn, message: sent.append(message)
+    pending = iter(requests + [None])
+    server.receive = lambda conn: next(pending)
+
+    conn, peer = socket.socketpair()
+    peer.sendall(b"hello")
+    server.client_thread(conn)
+    peer.close()
+    return sent
+
+
+def test_server_sends_leaderboard_before_the_reply():
+    sent = server_messages(["control:leaderboard"], [("p1", 7), ("p2", 3)])
+
+    assert sent[0] == "leaderboard:p1=7*p2=3"
+    assert sent[1].startswith("pos:")
+
+
+def test_leaderboard_returns_the_current_answer():
+    sent = server_messages(["control:leaderboard", "control:leaderboard"], [("p1", 7)])
+    client = network.SnakeClient(private_key=object())
+    client.network = FakeNetwork(sent)
+
+    assert client.leaderboard() == [("p1", 7)]
+    assert client.leaderboard() == [("p1", 7)]
+    # Nothing stale is left behind for the next request
+    assert client.network.messages[0].startswith("pos:")
+    assert client.poll() is client.state
+    assert client.network.messages == []
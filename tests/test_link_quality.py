@@ -0,0 +1,103 @@
+import pytest
+
+import link_quality
+from link_quality import ClientLink, MODE_FULL, MODE_REDUCED, MAX_STRIDE
+
+
+class FakeConditions:
+    """
+    Stands in for tcp_rtt and send_backlog, which read the kernel's view of the socket.
+    """
+
+    def __init__(self, monkeypatch):
+        self.rtt = 0.01
+        self.backlog = 0
+        monkeypatch.setattr(link_quality, "tcp_rtt", lambda conn: self.rtt)
+        monkeypatch.setattr(link_quality, "send_backlog", lambda conn: self.backlog)
+
+
+@pytest.fixture
+def conditions(monkeypatch):
+    return FakeConditions(monkeypatch)
+
+
+def test_backs_off_then_reduces(conditions):
+    link = ClientLink(None)
+    conditions.rtt = link_quality.RTT_HIGH * 2
+
+    steps = []
+    for tick in range(4):
+        link.mark_sent(tick)
+        steps.append((link.stride, link.mode))
+
+    assert steps == [(2, MODE_FULL), (MAX_STRIDE, MODE_FULL),
+                     (MAX_STRIDE, MODE_REDUCED), (MAX_STRIDE, MODE_REDUCED)]
+
+
+def test_send_backlog_alone_backs_off(conditions):
+    link = ClientLink(None)
+    conditions.backlog = link_quality.BACKLOG_HIGH + 1
+
+    link.mark_sent(0)
+
+    assert link.stride == 2
+
+
+def test_recovers_one_step_at_a_time(conditions):
+    link = ClientLink(None)
+    link.stride, link.mode = MAX_STRIDE, MODE_REDUCED
+
+    steps = []
+    for tick in range(4):
+        link.mark_sent(tick)
+        steps.append((link.stride, link.mode))
+
+    assert steps == [(MAX_STRIDE, MODE_FULL), (2, MODE_FULL), (1, MODE_FULL), (1, MODE_FULL)]
+
+
+def test_holds_between_thresholds(conditions):
+    link = ClientLink(None)
+    link.stride = 2
+    conditions.rtt = (link_quality.RTT_LOW + link_quality.RTT_HIGH) / 2
+
+    link.mark_sent(0)
+
+    assert (link.stride, link.mode) == (2, MODE_FULL)
+
+
+def test_unknown_link_counts_as_good(monkeypatch):
+    monkeypatch.setattr(link_quality, "tcp_rtt", lambda conn: None)
+    monkeypatch.setattr(link_quality, "send_backlog", lambda conn: None)
+    link = ClientLink(None)
+    link.stride = 2
+
+    link.mark_sent(0)
+
+    assert link.stride == 1
+
+
+def test_skipped_counts_ticks_not_polls(conditions):
+    link = ClientLink(None)
+    link.stride = MAX_STRIDE
+    conditions.rtt = (link_quality.RTT_LOW + link_quality.RTT_HIGH) / 2
+
+    # Twelve polls per tick, as a 60 FPS client polls a 5 tick/s server
+    for tick in range(13):
+        for _ in range(12):
+            if link.should_send(tick):
+                link.mark_sent(tick)
+
+    assert link.sent == 4
+    assert link.skipped == 9
+    assert link.metrics()["sent"] == 4
+
+
+def test_reduced_sends_are_counted(conditions):
+    link = ClientLink(None)
+    link.mode = MODE_REDUCED
+    conditions.rtt = (link_quality.RTT_LOW + link_quality.RTT_HIGH) / 2
+
+    link.mark_sent(0)
+    link.mark_sent(1)
+
+    assert link.reduced == 2
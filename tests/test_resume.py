@@ -0,0 +1,132 @@
+import itertools
+import socket
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("pygame")
+pytest.importorskip("cryptography")
+
+import network
+import snake_server
+from Snake import SnakeGame
+
+
+def make_server():
+    server = snake_server.GameServer.__new__(snake_server.GameServer)
+    server.game = SnakeGame(20)
+    server.game_state = server.game.get_state()
+    server.tick = 0
+    server.moves_queue = set()
+    server.player_connections = {}
+    server.links = {}
+    server.stream = snake_server.StateStream()
+    server.sessions = {}
+    server.player_keys = {}
+    server.disconnected = {}
+    server.private_key = network.shared_private_key()
+    server.public_key = server.private_key.public_key()
+    server.events = []
+    server.game.add_listener(lambda event: server.events.append(event[0]))
+    return server
+
+
+def session(server, hello, requests):
+    """
+    Run GameServer.client_thread for one connection and return what it sent. The
+    requests are followed by a dropped connection unless they end with "quit".
+    """
+    sent = []
+    server.send = lambda conn, message: sent.append(message)
+    server.send_encrypted = lambda conn, public_key, message: sent.append(message)
+    pending = itertools.chain(requests, [None])
+    server.receive = lambda conn: next(pending)
+
+    conn, peer = socket.socketpair()
+    peer.sendall(hello)
+    server.client_thread(conn)
+    peer.close()
+    return sent
+
+
+def join(server, requests):
+    hello = network.serialize_public_key(server.public_key).encode()
+    sent = session(server, hello, requests)
+    player_id, _, token = network.parse_welcome(sent[1])
+    return player_id, token
+
+
+def resume(server, token, requests=()):
+    encrypted = network.encrypt_message(server.public_key, token.encode())
+    return session(server, b"resume:" + encrypted, requests)
+
+
+def test_tick_after_quit_with_a_queued_move():
+    server = make_server()
+    player_id, _ = join(server, ["left", "quit"])
+
+    assert (player_id, "left") in server.moves_queue
+    assert player_id not in server.game.players
+    server.step()
+    assert server.tick == 1
+    assert server.moves_queue == set()
+
+
+def test_dropped_snake_holds_still():
+    server = make_server()
+    player_id, _ = join(server, [])
+    snake = server.game.players[player_id]
+    # One step from the bottom wall, a tick would kill it if it still moved
+    snake.reset((5, server.game.rows - 1))
+
+    for _ in range(5):
+        server.step()
+
+    assert player_id in server.game.paused
+    assert player_id in server.disconnected
+    assert snake.head.pos == (5, server.game.rows - 1)
+    assert "death" not in server.events
+
+
+def test_resume_sends_a_keyframe_and_unpauses():
+    server = make_server()
+    player_id, token = join(server, [])
+    server.step()
+
+    paused = []
+
+    def requests():
+        # Runs once the resumed connection is serving requests
+        paused.append(player_id in server.game.paused or player_id in server.disconnected)
+        yield "control:get"
+
+    sent = resume(server, token, requests())
+
+    welcome_id, rows, new_token = network.parse_welcome(sent[0])
+    assert welcome_id == player_id
+    assert rows == server.game.rows
+    assert new_token != token
+    assert sent[1] == "pos:{}".format(server.game_state)
+    assert paused == [False]
+
+
+def test_resume_token_works_once():
+    server = make_server()
+    player_id, token = join(server, [])
+    sent = resume(server, token)
+    new_token = network.parse_welcome(sent[0])[2]
+
+    assert resume(server, token) == ["resume:expired"]
+    sent = resume(server, new_token)
+    assert network.parse_welcome(sent[0])[0] == player_id
+
+
+def test_expired_session_cannot_resume():
+    server = make_server()
+    player_id, token = join(server, [])
+    server.disconnected[player_id] = time.time() - snake_server.RESUME_GRACE - 1
+    server.step()
+
+    assert player_id not in server.game.players
+    assert resume(server, token) == ["resume:expired"]
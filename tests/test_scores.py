@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+import scores
+from scores import ScoreWriter
+
+
+def test_writer_batches_events_and_serves_leaderboard(tmp_path):
+    writer = ScoreWriter(str(tmp_path / "scores.db")).start()
+    writer.record(("join", "a", 1, time.time()))
+    writer.record(("snack", "a", 2, time.time()))
+    writer.record(("snack", "b", 5, time.time()))
+    writer.record(("death", "a", 2, time.time()))
+    writer.close()
+
+    assert writer.written == 4
+    assert writer.leaderboard(2) == [("b", 5), ("a", 2)]
+    db = sqlite3.connect(str(tmp_path / "scores.db"))
+    assert db.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    assert db.execute("SELECT player_id, best_length, snacks, deaths FROM scores ORDER BY player_id").fetchall() == \
+        [("a", 2, 1, 1), ("b", 5, 1, 0)]
+
+
+def test_writer_survives_database_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(scores, "RETRY_DELAY", 0.01)
+    writer = ScoreWriter(str(tmp_path / "scores.db"))
+    write = writer._write
+    failures = []
+
+    def flaky_write(db, batch):
+        # Fail the first attempt as if the database were locked
+        if not failures:
+            failures.append(batch)
+            raise sqlite3.OperationalError("database is locked")
+        write(db, batch)
+
+    writer._write = flaky_write
+    writer.start()
+    writer.record(("snack", "a", 3, time.time()))
+    time.sleep(0.5)
+    writer.record(("snack", "b", 4, time.time()))
+    writer.close()
+
+    assert failures
+    assert writer.written == 2
+    assert writer.dropped == 0
+    assert writer.leaderboard() == [("b", 4), ("a", 3)]
@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip("pygame")
+pytest.importorskip("cryptography")
+
+from network import parse_state
+from Snake import SnakeGame, cube
+
+
+def make_game(snakes, snacks=()):
+    """
+    A game with the given snakes, each a list of cells head first.
+    """
+    game = SnakeGame(100)
+    for user_id, cells in snakes.items():
+        game.add_player(user_id, color=(255, 0, 0))
+        snake = game.players[user_id]
+        snake.body = [cube(pos) for pos in cells]
+        snake.head = snake.body[0]
+    game.snacks = [cube(pos) for pos in snacks]
+    return game
+
+
+def test_view_keeps_only_cells_in_radius():
+    game = make_game({"a": [(50, 50), (50, 49), (50, 48), (50, 47)]},
+                     snacks=[(52, 52), (60, 60)])
+
+    snacks, players = parse_state(game.get_state_view((50, 50), 2))
+
+    assert players == {"a": [(50, 50), (50, 49), (50, 48)]}
+    assert snacks == [(52, 52)]
+
+
+def test_snake_in_view_with_its_head_out_of_view_keeps_its_head_first():
+    game = make_game({"a": [(50, 47), (50, 48), (50, 49), (50, 50)]})
+
+    _, players = parse_state(game.get_state_view((50, 51), 2))
+
+    # The client draws the first cell as the head, which must be the real one
+    assert players == {"a": [(50, 47), (50, 49), (50, 50)]}
+
+
+def test_snakes_out_of_view_are_left_out():
+    game = make_game({
+        "near": [(50, 50)],
+        "far": [(90, 90), (90, 89)],
+        # Long enough to reach the view from its head, but every cell is outside it
+        "long": [(50, 55), (51, 55), (52, 55), (53, 55), (54, 55)],
+    })
+
+    _, players = parse_state(game.get_state_view((50, 50), 2))
+
+    assert list(players) == ["near"]
+
+
+def test_whole_board_in_view_matches_get_state():
+    game = make_game({"a": [(5, 5), (5, 4)], "b": [(9, 9)]}, snacks=[(1, 1)])
+
+    assert parse_state(game.get_state_view((50, 50), 100)) == parse_state(game.get_state())